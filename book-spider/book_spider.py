@@ -1,112 +1,194 @@
 import asyncio
+import csv
+import random
 import re
-from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from typing import Dict, List
 from urllib.parse import urljoin
 
-import pandas as pd
-from bs4 import BeautifulSoup
-from httpx import AsyncClient, AsyncHTTPTransport, Timeout
-from utils import execute_batch_with_interval, execute_with_interval, make_request
+from httpx import AsyncClient, AsyncHTTPTransport, Limits, Timeout
+from lxml.etree import HTMLPullParser, XPath, iterparse
+from utils import UA_POOL, RateLimiter, make_request
 
 URL = "http://books.toscrape.com/catalogue/page-{}.html"
-SLEEP_TIME = 2
-BATCH_SIZE = 10
+CONCURRENCY = 20
+# 0 disables the rate limit
+RPS = 5
+FIELDNAMES = ("genre", "title", "price", "stock", "upc")
+PARSE_CHUNK_SIZE = 4096
 
+GENRE_XP = XPath('string(//ul[@class="breadcrumb"]/li[3]/a)', smart_strings=False)
+TITLE_XP = XPath("string(//h1)", smart_strings=False)
+PRICE_XP = XPath('string(//*[contains(@class, "price_color")])', smart_strings=False)
+STOCK_XP = XPath('string(//*[contains(@class, "instock")])', smart_strings=False)
+UPC_XP = XPath("string(//table//tr[1]/td)", smart_strings=False)
 
-def scrape_book_details(html: str) -> Dict:
-    """Scrape book data from the html.
+PRICE_RE = re.compile(r"\d+\.\d{2}")
+STOCK_RE = re.compile(r"\d+")
+
+
+def scrape_book_details(html: bytes) -> Dict:
+    """Scrape book data from the html. Only the html up to the first table cell,
+    the upc, is parsed since every field is found before it.
 
     Args:
-        html (str): html to be scraped
+        html (bytes): html to be scraped
 
     Returns:
         Dict: book data
     """
     book = {}
-    soup = BeautifulSoup(html, "lxml")
-    book["genre"] = str(soup.select_one(".breadcrumb > li:nth-child(3) a").string)
-    book["title"] = str(soup.find("h1").string)
-    price = str(soup.find(class_="price_color").string)
-    book["price"] = re.search(r"\d+\.\d{2}", price).group()
-    stock = str(soup.find(class_="instock").text)
-    book["stock"] = re.search(r"\d+", stock).group()
-    book["upc"] = str(soup.select_one("table  tr:nth-child(1) > td").string)
+    parser = HTMLPullParser(events=("end",), tag="td")
+
+    for start in range(0, len(html), PARSE_CHUNK_SIZE):
+        parser.feed(html[start : start + PARSE_CHUNK_SIZE])
+        if any(True for _ in parser.read_events()):
+            break
+
+    tree = parser.close()
+    book["genre"] = GENRE_XP(tree)
+    book["title"] = TITLE_XP(tree)
+    book["price"] = PRICE_RE.search(PRICE_XP(tree)).group()
+    book["stock"] = STOCK_RE.search(STOCK_XP(tree)).group()
+    book["upc"] = UPC_XP(tree)
 
     return book
 
 
-async def get_book_data(client: AsyncClient, url: str) -> Dict:
-    """Make the request to the book page and scrape the data, with a random
-    delay before sending the request.
+async def get_book_data(
+    client: AsyncClient,
+    url: str,
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+    pool: ProcessPoolExecutor,
+) -> Dict:
+    """Make the request to the book page and scrape the data in pool.
 
     Args:
         client (httpx.AsyncClient): client to send the request
         url (str): url to request
+        semaphore (asyncio.Semaphore): caps the number of concurrent requests
+        limiter (RateLimiter): caps the number of requests per second
+        pool (ProcessPoolExecutor): pool where the html is parsed
 
     Returns:
         Dict: book details
     """
-    response = await make_request(client, url, delay=True, seconds=SLEEP_TIME)
-    data = scrape_book_details(response)
+    response = await make_request(client, url, semaphore, limiter)
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(pool, scrape_book_details, response.content)
 
     return data
 
 
-def scrape_book_links(html: str) -> List:
+def scrape_book_links(html: bytes) -> List:
     """Scrape book links from the html.
 
     Args:
-        html (str): html to be scraped
+        html (bytes): html to be scraped
 
     Returns:
         List: book links
     """
-    soup = BeautifulSoup(html, "lxml")
-    books = soup.find_all(class_="product_pod")
     links = []
 
-    for book in books:
-        link = book.find("a")["href"]
-        link = urljoin(URL, str(link))
-        links.append(link)
+    # stream the articles instead of building the whole tree, clearing each one
+    # once its link is read
+    for _, article in iterparse(BytesIO(html), tag="article", html=True):
+        if "product_pod" in article.get("class", ""):
+            link = article.find(".//h3/a").get("href")
+            links.append(urljoin(URL, link))
+        article.clear()
 
     return links
 
 
-async def get_books(client: AsyncClient, url: str) -> List[Dict]:
-    """Get book data for all book listed in the page at url
+async def get_book_links(
+    client: AsyncClient,
+    url: str,
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+    pool: ProcessPoolExecutor,
+) -> List[str]:
+    """Get the links of all book listed in the page at url
 
     Args:
         client (httpx.AsyncClient): client to send the request
         url (str): url to request
+        semaphore (asyncio.Semaphore): caps the number of concurrent requests
+        limiter (RateLimiter): caps the number of requests per second
+        pool (ProcessPoolExecutor): pool where the html is parsed
 
     Returns:
-        List[Dict]: a dict per book data
+        List[str]: book links
     """
-    response = await make_request(client, url)
-    links = scrape_book_links(response)
-    results = await execute_batch_with_interval(
-        (get_book_data(client, link) for link in links),
-        seconds=SLEEP_TIME,
-        batch_size=BATCH_SIZE,
-    )
+    response = await make_request(client, url, semaphore, limiter)
+    loop = asyncio.get_running_loop()
+    links = await loop.run_in_executor(pool, scrape_book_links, response.content)
 
-    return results
+    return links
 
 
 async def main() -> None:
-    async with AsyncClient(
-        timeout=Timeout(10), transport=AsyncHTTPTransport(retries=1)
-    ) as client:
-
-        # send request to pages 1 to 50 and returns book data for listed
-        # books on each page
-        results = await execute_with_interval(
-            (get_books(client, URL.format(i)) for i in range(1, 51)), seconds=SLEEP_TIME
-        )
-
-    pd.DataFrame(chain.from_iterable(results)).to_csv("books.csv")
-
+    # every request made below shares the same concurrency and rate caps
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    limiter = RateLimiter(RPS)
+
+    # a single http2 client with a fixed user agent, so requests multiplex over
+    # a few kept alive connections. The limits are set on the transport because
+    # the client ignores them when a custom transport is given. With brotli
+    # installed httpx also advertises and decodes br responses on its own
+    transport = AsyncHTTPTransport(
+        retries=2,
+        http2=True,
+        limits=Limits(
+            max_connections=50, max_keepalive_connections=20, keepalive_expiry=30
+        ),
+    )
 
-asyncio.run(main())
+    # parsing is CPU bound, so it runs in worker processes to keep the event loop
+    # free for the requests
+    with open("books.csv", "w", newline="") as file, ProcessPoolExecutor() as pool:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+        writer.writeheader()
+
+        async with AsyncClient(
+            http2=True,
+            timeout=Timeout(10, connect=5),
+            transport=transport,
+            headers={"user-agent": random.choice(UA_POOL)},
+        ) as client:
+
+            # send request to pages 1 to 50 and start requesting the books of a
+            # page as soon as its links are scraped
+            listing_tasks = [
+                asyncio.create_task(
+                    get_book_links(client, URL.format(i), semaphore, limiter, pool)
+                )
+                for i in range(1, 51)
+            ]
+            book_tasks = []
+            for task in asyncio.as_completed(listing_tasks):
+                links = await task
+                book_tasks.extend(
+                    asyncio.create_task(
+                        get_book_data(client, link, semaphore, limiter, pool)
+                    )
+                    for link in links
+                )
+
+            # write the data of each book as soon as it is done
+            for task in asyncio.as_completed(book_tasks):
+                writer.writerow(await task)
+
+
+if __name__ == "__main__":
+    try:
+        import uvloop
+
+        uvloop.install()
+    except ImportError:
+        pass
+
+    asyncio.run(main())
@@ -1,109 +1,127 @@
 import asyncio
 import random
-from typing import Any, Coroutine, Generator, List
+import time
+from typing import Any, Awaitable, Callable
 
-from fake_useragent import UserAgent
-from httpx import AsyncClient, Response
+from httpx import AsyncClient, Response, TransportError
 
-fua = UserAgent()
+UA_POOL = (
+    "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/17.4 Safari/605.1.15",
+)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
 
-async def make_request(
-    client: AsyncClient, url: str, delay: bool = False, seconds: int = None
-) -> Response:
-    """Send a request to the specified url using the provided client, with an optional
-    delay before sending the request. The delay is a random float from 1 and seconds.
+class RateLimiter:
+    """Space the requests of all the tasks sharing it at a fixed interval of
+    1 / rps seconds, without bursts. A rps of 0 disables the limit."""
 
-    Args:
-        client (httpx.AsyncClient): client to send the request
-        url (str): url to request
-        delay (bool, optional): indicates whether to delay the request. Defaults to False
-        seconds (int, optional): seconds to sleep for if delay is set to True. Defaults to SLEEP_TIME
+    def __init__(self, rps: float) -> None:
+        """
+        Args:
+            rps (float): max number of requests per second, 0 for no limit
+        """
+        self.interval = 1 / rps if rps else 0
+        self.next_slot = time.monotonic()
+        self.lock = asyncio.Lock()
 
-    Returns:
-        Response: response of the request
-    """
-    if delay and not seconds:
-        raise ValueError(
-            "If delay is set to True, must provide a valid seconds argument."
-        )
-
-    headers = {"user-agent": fua.random}
-    request = client.get(url, headers=headers)
+    async def acquire(self) -> None:
+        """Reserve the next free slot and wait until it is due."""
+        if not self.interval:
+            return
 
-    if delay:
-        return await sleep_and_execute(request, seconds)
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
 
-    return await request
+        if wait > 0:
+            await asyncio.sleep(wait)
 
 
-async def sleep_and_execute(task: Coroutine, seconds: int) -> Any:
-    """Sleeps before executing the given task. The actual sleep time is a float
-    between 1 and seconds.
+async def make_request(
+    client: AsyncClient,
+    url: str,
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+) -> Response:
+    """Send a request to the specified url using the provided client. The request
+    waits for a free slot in semaphore and for the limiter before being sent, and is
+    retried on transient errors.
 
     Args:
-        task (Coroutine): task to be executed
-        seconds (int): seconds to sleep for
+        client (httpx.AsyncClient): client to send the request
+        url (str): url to request
+        semaphore (asyncio.Semaphore): caps the number of concurrent requests
+        limiter (RateLimiter): caps the number of requests per second
 
     Returns:
-        Any: result of the task
+        Response: response of the request
     """
-    if seconds <= 1:
-        raise ValueError("seconds must be greater than 1.")
-
-    await asyncio.sleep(random.uniform(1, seconds))
-    return await task
+    return await with_retry(send, client, url, semaphore, limiter)
 
 
-async def execute_with_interval(tasks: Generator, seconds: int) -> List:
-    """Executes a single task with a delay between tasks. The delay is a random float
-    between 1 and seconds. Returns a list of results.
+async def send(
+    client: AsyncClient,
+    url: str,
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+) -> Response:
+    """Send a GET request once semaphore has a free slot and limiter allows it.
 
     Args:
-        tasks (Generator): a generator to get each task
-        seconds (int): seconds to sleep for
+        client (httpx.AsyncClient): client to send the request
+        url (str): url to request
+        semaphore (asyncio.Semaphore): caps the number of concurrent requests
+        limiter (RateLimiter): caps the number of requests per second
 
     Returns:
-        List: list of results
+        Response: response of the request
     """
-    results = []
-
-    for task in tasks:
-        result = await sleep_and_execute(task, seconds)
-        results.append(result)
-
-    return results
-
-
-async def execute_batch_with_interval(
-    tasks: Generator, seconds: int, batch_size: int
-) -> List:
-    """Executes a batch of task with a delay between batches. The delay is a random
-    float between 1 and seconds. Returns a list of results.
+    async with semaphore:
+        await limiter.acquire()
+        return await client.get(url)
+
+
+async def with_retry(
+    fn: Callable[..., Awaitable[Response]],
+    *args: Any,
+    attempts: int = 4,
+    base: float = 0.5,
+    cap: float = 8,
+    **kwargs: Any,
+) -> Response:
+    """Call fn until it doesn't fail with a transport error or a transient status
+    code, up to attempts times. The wait between attempts doubles from base up to
+    cap seconds, plus a small random jitter, unless the response has a Retry-After
+    header. The last attempt's response is returned or its error raised.
 
     Args:
-        tasks (Generator): generator to get tasks
-        batch_size (int): number of task in a single batch
-        seconds (int): seconds to sleep for
+        fn (Callable[..., Awaitable[Response]]): function that sends the request
+        attempts (int, optional): max number of calls to fn. Defaults to 4
+        base (float, optional): seconds to wait after the first attempt. Defaults to 0.5
+        cap (float, optional): max seconds to wait between attempts. Defaults to 8
 
     Returns:
-        List: list of results
+        Response: response of the request
     """
-    results = []
-    task_iter = iter(tasks)
+    for attempt in range(1, attempts + 1):
+        wait = min(cap, base * 2 ** (attempt - 1)) + random.uniform(0, 0.25)
 
-    while True:
         try:
-            batch = []
-            for _ in range(batch_size):
-                batch.append(next(task_iter))
-
-            task = asyncio.gather(*batch)
-            results += await sleep_and_execute(task, seconds)
-        except StopIteration:
-            if batch:
-                task = asyncio.gather(*batch)
-                results += await sleep_and_execute(task, seconds)
-            break
-
-    return results
+            response = await fn(*args, **kwargs)
+        except TransportError:
+            if attempt == attempts:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt == attempts:
+                return response
+
+            retry_after = response.headers.get("retry-after", "")
+            if retry_after.isdigit():
+                wait = int(retry_after)
+
+        await asyncio.sleep(wait)